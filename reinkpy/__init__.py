@@ -34,8 +34,9 @@ e-waste and planned obsolescence beyond fixing your own printer. Please
 """
 
 
-def _parse_ieee1284_id(b: str) -> dict:
-    "Parse IEEE 1284 device id string"
+@functools.lru_cache(maxsize=64)
+def _parse_ieee1284_id(b: str) -> 'MappingProxyType':
+    "Parse IEEE 1284 device id string (cached, read-only result)"
     _log.debug(f'Parsing "{b}"')
     try:
         assert b.isascii()
@@ -46,23 +47,48 @@ def _parse_ieee1284_id(b: str) -> dict:
         if 'COMMAND SET' in d: d['CMD'] = d['COMMAND SET']
         if 'CMD' in d: d['CMD'] = tuple(d['CMD'].split(','))
         # COMMENT ; ACTIVE COMMAND SET
-        return d
+        from types import MappingProxyType
+        return MappingProxyType(d)
     except:
         _log.exception('Invalid ID string: %r', b)
 
 
+@functools.cache
+def _import_from(module: str, name: str):
+    "Import `name` from submodule `module` once per process"
+    from importlib import import_module
+    return getattr(import_module(module, __name__), name)
+
+
+class _cached_property:
+    "Like functools.cached_property, without the per-instance lock"
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        val = instance.__dict__[self.name] = self.func(instance)
+        return val
+
+
 class Device:
 
-    @property
+    @_cached_property
     def brand(self) -> str|None:
         i = self.info
         return i.get('brand') or i.get('MFG') or i.get('MANUFACTURER') or \
             i.get('manufacturer')
-    @property
+    @_cached_property
     def model(self) -> str|None:
         i = self.info
         return i.get('model') or i.get('MDL') or i.get('MODEL') or i.get('product')
-    @property
+    @_cached_property
     def serial_number(self) -> str|None:
         i = self.info
         return i.get('SN') or i.get('serial_number')
@@ -78,7 +104,10 @@ class Device:
     @classmethod
     def find(cls, timeout=5):
         "List available printer devices"
-        res = [d for c in cls.__subclasses__() for d in c.ifind(timeout=timeout)]
+        subs = cls.__subclasses__()
+        # network discovery goes on in the background while the other scans run
+        browser = NetworkDevice.browse(timeout) if NetworkDevice in subs else None
+        res = [d for c in subs for d in c.ifind(timeout=timeout, browser=browser)]
         _log.info('Found %i devices', len(res))
         return res
 
@@ -87,8 +116,7 @@ class Device:
         return UsbDevice(FileIO(fname))
     @staticmethod
     def from_usb(**spec):
-        from .usb import UsbIO
-        return UsbDevice(UsbIO.from_spec(**spec))
+        return UsbDevice(_import_from('.usb', 'UsbIO').from_spec(**spec))
     @staticmethod
     def from_ip(ip):
         return NetworkDevice(ip)
@@ -98,28 +126,25 @@ class UsbDevice(Device):
 
     @classmethod
     def ifind(cls, **kw):
-        from .usb import UsbIO
-        for c in (FileIO, UsbIO):
+        for c in (FileIO, _import_from('.usb', 'UsbIO')):
             for i in c.ifind():
                 yield cls(i)
 
     def __init__(self, io):
         self.io = io
 
-    @functools.cached_property
+    @_cached_property
     def info(self):
         from collections import ChainMap
         return ChainMap({}, self.io.info, self.epson.info)
 
-    @functools.cached_property
+    @_cached_property
     def d4(self):
-        from .d4 import D4Link
-        return D4Link(self.io)
+        return _import_from('.d4', 'D4Link')(self.io)
 
-    @functools.cached_property
+    @_cached_property
     def epson(self):
-        from .epson import EpsonD4
-        return EpsonD4(self.d4).configure()
+        return _import_from('.epson', 'EpsonD4')(self.d4).configure()
 
     def __str__(self):
         return super().__str__() + f' @{self.io}'
@@ -131,30 +156,38 @@ class UsbDevice(Device):
 class NetworkDevice(Device):
 
     @classmethod
-    def ifind(cls, timeout=5):
-        from .zeroconf import find
-        for (ip, name) in find(timeout):
+    def ifind(cls, timeout=5, browser=None):
+        "Network devices found by `browser` (as returned by `browse`), or in `timeout` sec"
+        if browser is None:
+            browser = cls.browse(timeout)
+            if browser is None:
+                return
+        for (ip, name) in browser.stop(timeout).by_addr.items():
             if ':' not in ip:   # ignore IPv6, not supported by pysnmp
                 yield cls(ip, name=name)
 
+    @staticmethod
+    def browse(timeout=5):
+        "Start looking for network devices for `timeout` sec, in the background"
+        if _import_from('.zeroconf', 'AVAILABLE'):
+            return _import_from('.zeroconf', 'Browser')().start(timeout)
+
     def __init__(self, ip, **kw):
         self.ip = ip
         self.__dict__.update(kw)
 
-    @functools.cached_property
+    @_cached_property
     def info(self):
         from collections import ChainMap
         return ChainMap({}, self.snmp.info, self.epson.info)
 
-    @functools.cached_property
+    @_cached_property
     def snmp(self):
-        from .snmp import SNMPLink
-        return SNMPLink(self.ip)
+        return _import_from('.snmp', 'SNMPLink')(self.ip)
 
-    @functools.cached_property
+    @_cached_property
     def epson(self):
-        from .epson import EpsonSNMP
-        return EpsonSNMP(self.snmp).configure()
+        return _import_from('.epson', 'EpsonSNMP')(self.snmp).configure()
 
     def __str__(self):
         return super().__str__() + f' @{self.ip}'
@@ -167,20 +200,30 @@ class FileIO:
 
     @classmethod
     def ifind(cls, globs=('/dev/lp?', '/dev/usb/lp?')):
-        from glob import iglob
-        from pathlib import Path
+        import fnmatch, os, stat
         for g in globs:
-            for p in iglob(g):
-                p = Path(p)
-                if p.is_char_device():
-                    yield cls(p)
+            d, pat = os.path.split(g)
+            try:
+                it = os.scandir(d)
+            except OSError:
+                continue
+            with it:
+                for e in it:
+                    if not fnmatch.fnmatchcase(e.name, pat):
+                        continue
+                    try:
+                        st = e.stat()
+                    except OSError: # dangling link, no permission...
+                        continue
+                    if stat.S_ISCHR(st.st_mode):
+                        yield cls(e.path)
 
     def __init__(self, path, mode='a+b'):
         self.path = path
         self.mode = mode
         self._nctx = 0
 
-    @functools.cached_property
+    @_cached_property
     def info(self):
         return {'file_path': self.path}
 
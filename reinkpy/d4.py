@@ -7,46 +7,63 @@ __all__ = (
 
 from . import helpers
 
-import collections, contextlib, struct, time
+import collections, contextlib, struct, threading, time
 import logging
 _log = logging.getLogger(__name__)
+_DEBUG = logging.DEBUG
 del logging
 
 
-DELAY = 0.0
+_scratch = threading.local() # .buf: per-thread buffer for D4Link.protocol.encode
 
 
 class D4Link:
 
     CMD_ENTER_D4: bytes = None
     CMD_ENTER_D4_REPLY: bytes = None
+    # channels queue received data: several requests may be sent before reading
+    supports_pipeline = True
 
     class protocol:
-        hTuple = collections.namedtuple('D4PacketHeader', 'psid ssid length credit control')
+        # packed fields, then derived ones
+        hTuple = collections.namedtuple('D4PacketHeader', 'psid ssid length credit control'
+                                        ' payload_length cid cidkey')
         hStruct = struct.Struct('>BBHBB')
         hLen = hTuple.hLen = struct.calcsize(hStruct.format) # 6
-        hTuple.payload_length = property(lambda self: self.length - self.hLen)
-        hTuple.cid = property(lambda self: self[:2])
+
+        @classmethod
+        def header(cls, psid, ssid, length, credit, control):
+            return cls.hTuple(psid, ssid, length, credit, control,
+                              length - cls.hLen, (psid, ssid), psid << 8 | ssid)
 
         @classmethod
         def decode(cls, b):
-            "Returns (header, payload)"
-            return cls.hTuple(*cls.hStruct.unpack(b[:cls.hLen])), b[cls.hLen:]
+            "Returns (header, payload), payload being a memoryview of `b`"
+            # same as hStruct.unpack_from(b, 0), without the struct dispatch
+            return (cls.header(b[0], b[1], (b[2] << 8) | b[3], b[4], b[5]),
+                    memoryview(b)[cls.hLen:])
 
         @classmethod
         def encode(cls, payload=b'', psid=0, ssid=0, credit=1, control=0):
-            payload = bytes(payload)
-            return cls.hStruct.pack(psid, ssid, (cls.hLen + len(payload)),
-                                    credit, control) + payload
+            if not isinstance(payload, (bytes, bytearray)):
+                payload = bytes(payload)
+            n = cls.hLen + len(payload)
+            buf = getattr(_scratch, 'buf', None)
+            if buf is None or len(buf) < n:
+                buf = _scratch.buf = bytearray(max(n, 8192))
+            cls.hStruct.pack_into(buf, 0, psid, ssid, n, credit, control)
+            buf[cls.hLen:n] = payload
+            return bytes(memoryview(buf)[:n])
 
     def __init__(self, target):
         self.target = target
         self._init_channels()
         self._nctx = 0
+        self._received = bytearray()
 
     def _init_channels(self):
-        self.channels = {}      # (psid, ssid): channel
-        self.txn = self.channels[TXChannel.cid] = TXChannel(self)
+        self.channels = {}      # psid << 8 | ssid: channel
+        self.txn = self.channels[TXChannel.cidkey] = TXChannel(self)
 
     def __enter__(self):
         if self._nctx == 0:
@@ -104,35 +121,62 @@ class D4Link:
             for retry in range(3):
                 if channel.credit >= cost: # TODO: retry in loop?
                     break
-                self.txn('CreditRequest', *channel.cid)
+                # ask for a block of credits, to cover the next sends too
+                if 'maxCredit' in self.txn.protocol.cmd_by_name['CreditRequest']._fields:
+                    self.txn('CreditRequest', *channel.cid, maxCredit=max(8*cost, 64))
+                else: # revision 0x10
+                    self.txn('CreditRequest', *channel.cid)
                 # self.txn('Credit', *channel.cid, 1)
             else:
                 _log.error('Missing credits to send on %s', (channel.cid,))
                 return
         channel.credit -= cost
         b = self.protocol.encode(payload, *channel.cid, credit, control)
-        _log.debug('Sending on %s: %s', channel.cid, helpers.hexdump(b, prefix='\n<<'))
+        if _log.isEnabledFor(_DEBUG):
+            _log.debug('Sending on %s: %s', channel.cid, helpers.hexdump(b, prefix='\n<<'))
         return self.target.write(b)
 
     def retreive(self, retries=6): # needs grouping packets->message?
-        rest = getattr(self, '_received', b'')
+        "Dispatch the next packet received, reading from target as needed; True if one was"
         for i in range(1 + retries):
-            resp = self.target.read()
-            if resp:
-                rest += resp
-                header, payload = self.protocol.decode(rest)
-                if len(payload) < header.payload_length:
+            # one read may bring several packets: use up those buffered first
+            packet = self._pop_packet()
+            if packet is None:
+                resp = self.target.read()
+                if not resp:
+                    continue
+                self._received.extend(resp)
+                packet = self._pop_packet()
+                if packet is None:
                     continue
-                payload, rest = payload[:header.payload_length], payload[header.payload_length:]
-                self._received = rest
-                return self._on_received(header, payload)
+            self._on_received(*packet)
+            return True
+
+    def _pop_packet(self):
+        "Remove and return the first complete (header, payload) received, if any"
+        rest, hLen = self._received, self.protocol.hLen
+        if len(rest) < hLen:
+            return
+        # not decode(): a memoryview export would lock `rest` size
+        header = self.protocol.header(*self.protocol.hStruct.unpack_from(rest, 0))
+        if header.length < hLen: # corrupt: no way to tell where the next packet starts
+            _log.warning('Dropping %i bytes received after invalid header: %s', len(rest), header)
+            rest.clear()
+            return
+        end = hLen + header.payload_length
+        if len(rest) < end:
+            return
+        payload = bytes(rest[hLen:end])
+        del rest[:end]
+        return header, payload
 
     def _on_received(self, header, payload): # dispatch to channels
-        _log.debug('Received packet in %s: %s', header, helpers.hexdump(payload, prefix='\n>>'))
-        if header.cid not in self.channels:
+        if _log.isEnabledFor(_DEBUG):
+            _log.debug('Received packet in %s: %s', header, helpers.hexdump(payload, prefix='\n>>'))
+        c = self.channels.get(header.cidkey)
+        if c is None:
             _log.warning('Ignoring packet received on unknown channel: %s', header.cid)
             return
-        c = self.channels[header.cid]
         c.credit += header.credit # piggybacked
         if payload:
             return c.on_received(payload, header)
@@ -141,14 +185,15 @@ class D4Link:
         if serviceName is None and cid is None:
             raise ValueError('A service name or channel ID is required')
         elif serviceName and cid:
-            if cid not in self.channels:
-                self.channels[cid] = Channel(self, cid, serviceName)
-            c = self.channels[cid]
+            c = self.channels.get(_cidkey(cid))
+            if c is None:
+                c = self.channels[_cidkey(cid)] = Channel(self, cid, serviceName)
             assert c.name == serviceName
             return c
         elif cid:
-            if cid in self.channels:
-                return self.channels[cid]
+            c = self.channels.get(_cidkey(cid))
+            if c is not None:
+                return c
             else:
                 p = self.txn('GetServiceName', cid[1])
         else:
@@ -161,32 +206,42 @@ class D4Link:
             _log.error('Cannot get channel for %s %s: %s', (serviceName, cid, p))
             return
         cid = (p.socketID, p.socketID) # mirror peer
-        c = self.channels[cid] = Channel(self, cid, p.serviceName)
+        c = self.channels[_cidkey(cid)] = Channel(self, cid, p.serviceName)
         return c
 
 
+def _cidkey(cid):
+    "Dict key for channel ID (psid, ssid)"
+    return cid[0] << 8 | cid[1]
+
+
 def _make_tx_command(code, name, sformat, fields, defaults=()):
     hTuple = collections.namedtuple('%s' % name, fields, defaults=defaults)
     hTuple.code = code
     hTuple.name = name
+    hTuple.has_credit = 'addCredit' in hTuple._fields
+    hTuple.is_error = name == 'Error'
 
     hStruct = struct.Struct('>' + sformat.replace('*', ''))
     hFormat = hStruct.format
     hLen = struct.calcsize(hStruct.format)
     star = fields[-1] if sformat.endswith('*') else None # serviceName
+    # truncated formats, longest first
+    hPrefixes = tuple(struct.Struct(hFormat[:sCap]) for sCap in range(len(hFormat)-1,1,-1))
 
-    def decode(b):
-        if len(b) < hLen and not star:
-            # _log.debug('Decoding truncated commmand: %s', b.hex())
-            for sCap in range(len(hFormat)-1,1,-1):
-                bCap = struct.calcsize(hFormat[:sCap])
-                if bCap <= len(b):
-                    return hTuple(*struct.unpack(hFormat[:sCap], b[:bCap]))
-        f = hStruct.unpack(b[:hLen])
-        if star:
-            return hTuple(*f, b[hLen:].decode('ascii'))
-        else:
-            return hTuple(*f)
+    if star:
+        def decode(b):
+            return hTuple(*hStruct.unpack_from(b, 0), b[hLen:].decode('ascii'))
+    else:
+        def decode(b):
+            try:
+                return hTuple(*hStruct.unpack_from(b, 0))
+            except struct.error: # truncated?
+                # _log.debug('Decoding truncated commmand: %s', b.hex())
+                for s in hPrefixes:
+                    if s.size <= len(b):
+                        return hTuple(*s.unpack_from(b, 0))
+                raise
     hTuple.decode = staticmethod(decode)
 
     if star:
@@ -208,7 +263,9 @@ def _make_tx_command(code, name, sformat, fields, defaults=()):
 class protocol:
     @classmethod
     def decode(cls, b):
-        cmd = cls.cmd_by_code[struct.unpack('B', b[:1])[0]]
+        cmd = cls.cmd_by_code_tbl[b[0]]
+        if cmd is None:
+            raise KeyError(b[0])
         return cmd.decode(b[1:])
 
     @classmethod
@@ -249,6 +306,10 @@ class protocol_0x20(protocol):
         (0x7F, 'Error',               'BBB',   'errorPSID errorSSID errorCode')
     ))
     cmd_by_code = dict((c.code, c) for c in cmd_by_name.values())
+    cmd_by_code_tbl = tuple(map(cmd_by_code.get, range(256)))
+    # pre-encoded commands that take no arguments (Init, Exit)
+    static_payloads = dict((n, c.encode()) for (n, c) in cmd_by_name.items()
+                           if len(c._field_defaults) == len(c._fields))
 
 class protocol_0x10(protocol):
     "Transaction channel protocol revision 0x10."
@@ -275,11 +336,16 @@ class protocol_0x10(protocol):
         (0x7F, 'Error',               'BBB',   'errorPSID errorSSID errorCode')
     ))
     cmd_by_code = dict((c.code, c) for c in cmd_by_name.values())
+    cmd_by_code_tbl = tuple(map(cmd_by_code.get, range(256)))
+    # pre-encoded commands that take no arguments (Init, Exit)
+    static_payloads = dict((n, c.encode()) for (n, c) in cmd_by_name.items()
+                           if len(c._field_defaults) == len(c._fields))
 
 
 
 class TXChannel:
     cid = (0x00, 0x00)
+    cidkey = 0x0000
     name = '(transaction channel)'
     # maxPTS, maxSTP = (64, 64) # max packet size NotImplemented
     protocol = protocol_0x20
@@ -295,23 +361,32 @@ class TXChannel:
     def __exit__(self, *exc):
         self.link.__exit__(*exc)
 
-    def __call__(self, cmd, *a, **kw):
+    def __call__(self, cmd, *a, retries=7, backoff=0.001, **kw):
+        # IEEE 1284.4 reply codes are the command code with the MSB set
+        expected_code = self.protocol.cmd_by_name[cmd].code | 0x80
         ok = self.send(cmd, *a, **kw)
-        self._received = None
-        time.sleep(DELAY)
-        for r in range(8):
-            self.link.retreive()
-            if self._received:
-                p = self._received
-                if p.name == cmd + 'Reply':
-                    return p
-                else:
-                    _log.debug('TX: dropping packet (not a %s): %s', cmd+'Reply', p)
+        for r in range(1 + retries):
+            self._received = None
+            # packets for other channels get queued there, without using up a retry
+            while self.link.retreive() and self._received is None:
+                pass
+            p = self._received
+            if p is None:
+                if r < retries: # wait only when nothing came in
+                    time.sleep(backoff)
+                    backoff *= 2
+            elif p.code == expected_code:
+                return p
+            elif _log.isEnabledFor(_DEBUG):
+                _log.debug('TX: dropping packet (not a %s): %s', cmd+'Reply', p)
         _log.warning('TX: did not receive expected %s', cmd+'Reply')
 
     def send(self, cmd, *a, **kw):
-        payload = self.protocol.encode(cmd, *a, **kw)
-        _log.debug('TX: sending: %s', (self.protocol.decode(payload),))
+        payload = None if (a or kw) else self.protocol.static_payloads.get(cmd)
+        if payload is None:
+            payload = self.protocol.encode(cmd, *a, **kw)
+        if _log.isEnabledFor(_DEBUG):
+            _log.debug('TX: sending: %s', (self.protocol.decode(payload),))
         return self.link.send(payload, self, cost=0 if cmd == 'Init' else 1,
                               check=cmd not in ('CreditRequest', 'Credit'))
 
@@ -324,11 +399,14 @@ class TXChannel:
         else:
             _log.debug('TX: received: %s', (p,))
             self._received = p
-            if hasattr(p, 'addCredit'):
-                c = self.link.channels[(p.sidP, p.sidS)]
+            if p.has_credit:
+                c = self.link.channels.get(p.sidP << 8 | p.sidS)
+                if c is None:
+                    _log.warning('TX: ignoring credits for unknown channel (%s,%s)', p.sidP, p.sidS)
+                    return
                 c.credit += p.addCredit
                 _log.debug('TX: added %i credits to (%s,%s), now has %i', p.addCredit, *c.cid, c.credit)
-            if p.name == 'Error':
+            if p.is_error:
                 _log.warning('TX: received: %s %s', p, self.protocol.ERRORS[p.errorCode])
 
 class Channel:
@@ -336,10 +414,12 @@ class Channel:
     def __init__(self, link, cid, name):
         self.link = link
         self.cid = cid
+        self.cidkey = _cidkey(cid)
         self.name = name
         self.credit = 0
         # maxPTS, maxSTP = (0xffff, 0xffff)
         self._nctx = 0
+        self._received = collections.deque()
 
     def __enter__(self):
         if self._nctx == 0:
@@ -356,25 +436,33 @@ class Channel:
     def __call__(self, data):
         if not isinstance(data, bytes):
             raise Exception('D4 Channel %s: invalid data (must be bytes): %r' % (self.name, data))
+        self.clear()
         ok = self.send(data)
         return self.retreive()
 
+    def clear(self):
+        "Drop data received and not retreived yet"
+        if self._received:
+            _log.debug('%s: Dropping previous packets received: %s', self.name, self._received)
+            self._received.clear()
+
     def retreive(self, retries=6):
-        # if getattr(self, '_received', None):
-        #     _log.debug('%s: Dropping previous packet received: %s', self.name, self._received)
-        self._received = None
+        "Returns the oldest data received, reading from the link as needed"
+        q = self._received
         for r in range(1 + retries):
-            self.link.retreive()
-            if self._received:
-                return self._received
+            if not q:
+                self.link.retreive()
+            if q:
+                return q.popleft()
 
     def send(self, data):
-        _log.debug('%s << %s', self.name, helpers.hexdump(data))
+        if _log.isEnabledFor(_DEBUG):
+            _log.debug('%s << %s', self.name, helpers.hexdump(data))
         return self.link.send(data, self)
 
     def on_received(self, data, header=None):
         _log.debug('%s >> %s', self.name, data)
-        self._received = data
+        self._received.append(data)
 
 
 def decode(packets):
@@ -382,6 +470,7 @@ def decode(packets):
     prot = protocol_0x20
     for b in packets:
         header, payload = D4Link.protocol.decode(b)
+        payload = bytes(payload)
         if header.cid == TXChannel.cid:
             for p in [prot, protocol_0x20, protocol_0x10]:
                 try:
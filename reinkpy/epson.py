@@ -3,25 +3,53 @@ __all__ = (
     'EpsonDriver',
 )
 
-import collections, contextlib, dataclasses, functools, hashlib, importlib.resources, re, struct, tomllib, typing
+import collections, contextlib, dataclasses, functools, hashlib, importlib.resources, itertools, re, struct, tomllib, types, typing
 import logging
 _log = logging.getLogger(__name__)
 del logging
 
-
-DB = {}
-def get_db():
-    # global DB
-    if not DB:
-        with importlib.resources.files('reinkpy').joinpath('epson.toml').open('rb') as f:
-            specs = tomllib.load(f)['EPSON']
-        for s in specs:
-            if 'wkey' in s:
-                s['wkey'] = s['wkey'].encode('latin-1')
-            # s['brand'] = 'EPSON'
-            for m in s.get('models',()):
-                DB[m] = collections.ChainMap({'model': m}, s)
-    return DB
+# addresses are little endian; field values big endian (here 1-byte)
+_S_FACTORY = struct.Struct('<2sHHBBB') # cmd*2, length, rkey, c, ~c, rot(c)
+_S_LEN = struct.Struct('<H')
+_S_ADDR1, _S_ADDR2 = struct.Struct('<B'), struct.Struct('<H') # read request
+_S_WR1, _S_WR2 = struct.Struct('<BB'), struct.Struct('<HB')   # write request
+_S_RD1, _S_RD2 = struct.Struct('>BB'), struct.Struct('>HB')   # read response
+_EE_RE = re.compile(rb'\sEE:([0-9a-fA-F]{6});') # '@BDC PS EE:ED0100;'
+_NONWORD_RE = re.compile(r'\W')
+_EJLID_RE = re.compile(r'^@EJL ID\s+((.|\s)+)')
+
+def get_db() -> types.MappingProxyType:
+    "Known models {model name: spec}"
+    return _load_db()
+
+@functools.cache
+def _load_db():
+    db = {}
+    with importlib.resources.files('reinkpy').joinpath('epson.toml').open('rb') as f:
+        specs = tomllib.load(f)['EPSON']
+    for s in specs:
+        if 'wkey' in s:
+            s['wkey'] = s['wkey'].encode('latin-1')
+        sAddr = _S_ADDR1 if s.get('rlen') == 1 else _S_ADDR2
+        for m in s.get('mem', ()):
+            m['name'], m['doc'] = _reset_meta(m['addr'], m['desc'])
+            _pack_addrs(sAddr, tuple(m['addr'])) # read back by atomic writes
+        # s['brand'] = 'EPSON'
+        for m in s.get('models',()):
+            db[m] = collections.ChainMap({'model': m}, s)
+    return types.MappingProxyType(db)
+
+
+@functools.lru_cache(maxsize=512)
+def _pack_addrs(sAddr: struct.Struct, addr: tuple[int, ...]) -> tuple[bytes, ...]:
+    "Packed EEPROM addresses, e.g. for whole-memory sweeps and known mem entries"
+    return tuple(map(sAddr.pack, addr))
+
+
+def _reset_meta(addr, desc):
+    "(__name__, __doc__) of the reset operation for a mem entry"
+    return ('_'.join(('do_reset', _NONWORD_RE.sub('_', desc), ''.join('x%02X' % a for a in addr))),
+            f'Reset {desc} {addr}')
 
 
 @dataclasses.dataclass(kw_only=True)
@@ -64,6 +92,9 @@ class Spec:
 
 class Epson:
 
+    # max requests sent ahead of their reply on the CTRL channel
+    pipeline_depth = 8
+
     def __init__(self, link, **spec):
         self.spec = Spec(**spec) # -> prop
         self.link = link        # d4 / snmp
@@ -73,7 +104,7 @@ class Epson:
     def detected_model(self):
         "Automatically detected printer model name"
         if 'MDL' in self.info:
-            return re.sub(' Series$', '', self.info['MDL'])
+            return self.info['MDL'].removesuffix(' Series')
         else:
             _log.warn('Detecting model name failed.')
 
@@ -96,38 +127,43 @@ class Epson:
                 _log.warn(f'Unknown model name: "{name}"')
         else:
             self.spec = Spec()
+        self.__dict__.pop('_mem_ops', None)
         m, d = (self.spec.model, self.detected_model)
         if m and d and m != d:
             _log.warn('Loading specs for model "%s" but the printer '
                       'presents itself as "%s"', m, d)
         return self
 
-    def _mem_ops(self):
-        for m in self.spec.mem:
-            yield self._make_reset(**m)
-        for g in ('waste counter', 'platen pad counter'):
-            m = self.spec.get_mem(g)
-            if m: yield self._make_reset(**m)
-
-    def _make_reset(self, addr=(), desc='', reset=(), min=(), **kw):
+    @functools.cached_property
+    def _mem_ops(self) -> dict:
+        "{name: func} of memory operations for the current spec (reset by `configure`)"
+        ops = {}
+        for m in (*self.spec.mem, *(self.spec.get_mem(g) for g in
+                                    ('waste counter', 'platen pad counter'))):
+            if m:
+                f = self._make_reset(**m)
+                ops.setdefault(f.__name__, f)
+        return ops
+
+    def _make_reset(self, addr=(), desc='', reset=(), min=(), name=None, doc=None, **kw):
         reset = reset or min or [0]*len(addr)
-        f = lambda: self.write_eeprom(*zip(addr, reset), atomic=True)
-        f.__name__ = '_'.join(('do_reset', re.subn(r'\W', '_', desc)[0],
-                               ''.join('x%02X' % a for a in addr)))
-        f.__doc__ = f'Reset {desc} {addr}'
+        if name is None:
+            name, doc = _reset_meta(addr, desc)
+        f = functools.partial(self.write_eeprom, *zip(addr, reset), atomic=True)
+        f.__name__, f.__doc__ = name, doc
         return f
 
     def __dir__(self):
         yield from super().__dir__()
-        for f in self._mem_ops():
-            yield f.__name__
+        yield from self._mem_ops
 
     def __getattr__(self, name):
         if name.startswith('do_'):
-            for f in self._mem_ops():
-                if name == f.__name__:
-                    return f
-        raise AttributeError
+            try:
+                return self._mem_ops[name]
+            except KeyError:
+                pass
+        raise AttributeError(name)
 
 
     def ctrl(self, *msg: bytes | tuple['cmd', 'payload']) -> tuple[bytes, ...]:
@@ -136,9 +172,75 @@ class Epson:
 
     def _ictrl(self, *msg: bytes | tuple['cmd', 'payload']) -> typing.Iterator[bytes]:
         with self.ctrl_channel as c:
-            for m in self._iencode(*msg):
+            msg = tuple(self._iencode(*msg))
+            if len(msg) < 2 or not getattr(self.link, 'supports_pipeline', False):
+                for m in msg:
+                    yield c(m)
+                return
+            # keep up to `pipeline_depth` requests in flight, replies come in order
+            res = []     # [(reply, matches)] in order; matches is None when unknown
+            pending = 0  # requests sent and not answered yet
+            failed = None # index of the first message to send again one by one
+            unsent = len(msg) # index of the first message not sent
+            c.clear()
+            for (i, m) in enumerate(msg):
+                if pending == self.pipeline_depth:
+                    failed = self._ictrl_receive(c, msg, res)
+                    pending -= 1
+                    if failed is not None:
+                        break
+                if not c.send(m): # no credit left, say: send the rest one by one
+                    unsent = i
+                    break
+                pending += 1
+            while failed is None and pending:
+                failed = self._ictrl_receive(c, msg, res)
+                pending -= 1
+            if failed is None:
+                yield from (r for (r, ok) in res)
+                for m in msg[unsent:]:
+                    yield c(m)
+                return
+            # a reply went missing or out of step: replies may have shifted since
+            # the last one known to match its request
+            failed = min(failed, len(res))
+            while failed > 0 and res[failed-1][1] is None:
+                failed -= 1
+            _log.warn('Pipelined ctrl replies out of step, resending %i message(s) '
+                      'one by one', len(msg) - failed)
+            for _ in range(pending): # drain late replies
+                c.retreive(retries=0)
+            c.clear()
+            for (r, ok) in res[:failed]:
+                yield r
+            for m in msg[failed:]:
                 yield c(m)
 
+    def _ictrl_receive(self, c, msg, res):
+        "Append the next reply to res, return its index if it does not answer its request"
+        i = len(res)
+        r = c.retreive()
+        ok = self._reply_matches(msg[i], r)
+        res.append((r, ok))
+        if ok is False:
+            return i
+
+    def _reply_matches(self, m, r) -> bool | None:
+        "Whether r answers ctrl message m, None if that cannot be told"
+        if r is None:
+            return False
+        if m[:2] == b'||' and m[6] == 0x41: # EEPROM read: check address
+            mm = _EE_RE.search(r)
+            if not mm: # answered, though not with a value
+                return None
+            sAddr, sVal = (_S_ADDR1, _S_RD1) if self.spec.rlen == 1 else (_S_ADDR2, _S_RD2)
+            try:
+                return (sVal.unpack(bytes.fromhex(mm.group(1).decode('ascii')))[0]
+                                     == sAddr.unpack_from(m, _S_FACTORY.size)[0])
+            except (ValueError, struct.error):
+                return False
+        return None
+
     def _iencode(self, *msg: bytes | tuple['cmd', 'payload']) -> typing.Iterator[bytes]:
         for m in msg:
             if isinstance(m, tuple):
@@ -147,33 +249,43 @@ class Epson:
             assert isinstance(m, bytes)
             yield m
 
-    def encode(self, cmd: str | tuple[str, str], payload: bytes = b'') -> bytes:
+    def encode(self, cmd: str | tuple[str, str], payload: bytes = b'', rkey=None) -> bytes:
         # payload = bytes(payload)
         if isinstance(cmd, tuple): # "factory command"
             c = ord(cmd[1])
-            p = struct.pack('<HBBB', self.spec.rkey, c, ~c & 0xff, (c>>1 & 0x7f) | (c<<7 & 0x80))
-            cmd, payload = cmd[0]*2, p + payload
+            if rkey is None:
+                rkey = self.spec.rkey
+            return _S_FACTORY.pack((cmd[0]*2).encode('ascii'), 5 + len(payload), rkey,
+                                   c, ~c & 0xff, (c>>1 & 0x7f) | (c<<7 & 0x80)) + payload
         if isinstance(cmd, str):
             cmd = cmd.encode('ascii')
         # assert len(cmd) == 2
-        return cmd + struct.pack('<H', len(payload)) + payload
+        return b''.join((cmd, _S_LEN.pack(len(payload)), payload))
 
     def read_eeprom(self, *addr: int) -> list[tuple[int, int|None]]:
         """Read addresses from EEPROM"""
         if not addr:
             addr = range(self.spec.mem_low, self.spec.mem_high+1)
-        c = 'B' if self.spec.rlen == 1 else 'H'
+        sAddr = _S_ADDR1 if self.spec.rlen == 1 else _S_ADDR2
         CMD = ('|', 'A') # (0x7c, 0x41)
+        resps = self.ctrl(*((CMD, p) for p in _pack_addrs(sAddr, tuple(addr))))
+        return self._decode_reads(addr, resps)
+
+    def _decode_reads(self, addr, resps) -> list[tuple[int, int|None]]:
+        sVal = _S_RD1 if self.spec.rlen == 1 else _S_RD2
+        ms = [_EE_RE.search(r or b'') for r in resps]
+        # values are big endian; here assuming 1-byte
+        buf = all(ms) and bytes.fromhex(b''.join(m.group(1) for m in ms).decode('ascii'))
+        if buf and len(buf) == sVal.size * len(ms): # decode all at once
+            vals = sVal.iter_unpack(buf)
+        else:
+            vals = (m and len(m.group(1)) == 2*sVal.size and
+                    sVal.unpack(bytes.fromhex(m.group(1).decode('ascii'))) for m in ms)
         res = []
-        for (a,r) in zip(addr, self._ictrl(*((CMD, struct.pack('<'+c, a)) for a in addr))):
-            try:
-                # '@BDC PS EE:ED0100;'
-                v = re.match(r'.*?\sEE:([0-9a-fA-F]{6,6});', r.decode('ascii'))
-                # values are big endian; here assuming 1-byte
-                p, val = struct.unpack('>'+c+'B', bytes.fromhex(v.group(1)))
-                assert p == a
-                res.append((a, val))
-            except:
+        for (a, r, pv) in zip(addr, resps, vals):
+            if pv and pv[0] == a:
+                res.append((a, pv[1]))
+            else:
                 _log.warn('Invalid response reading addr %s: %r', a, r)
                 res.append((a, None))
         return res
@@ -183,24 +295,22 @@ class Epson:
         """Write to EEPROM
 
         wkey -- secret 54-bit / 8 ASCII chars suffix key as found on XP Series
-        check_read -- read `addr` again to check that value was written
+        check_read -- read addresses again to check that values were written
         atomic -- try to restore original values on error
         """
+        addrval = [(a, v) for (a, v) in addrval] # pairs as read_eeprom returns them
         if atomic:
             prev = self.read_eeprom(*(a[0] for a in addrval))
             _log.info('Current EEPROM values: %s', prev)
         _log.info('Writing to EEPROM: %s', addrval)
         if wkey is None:
             wkey = self.spec.wkey
-        c = 'B' if self.spec.wlen == 1 else 'H'
+        sWrite = _S_WR1 if self.spec.wlen == 1 else _S_WR2
         CMD = ('|', 'B') # (0x7c, 0x42)
-        # addresses are little endian; field values big endian (here 1-byte)
-        res = True
-        for ((a,v),r) in zip(addrval,
-                             self._ictrl(*((CMD, struct.pack('<'+c+'B', a, v) + wkey)
-                                           for (a,v) in addrval))):
-            res &= ((b':OK;' in r) and ((not check_read) or
-                                        (self.read_eeprom(a) == [(a, v)])))
+        res = all(b':OK;' in (r or b'') for r in
+                  self.ctrl(*((CMD, sWrite.pack(a, v) + wkey) for (a,v) in addrval)))
+        if res and check_read: # one read-back for all addresses
+            res = self.read_eeprom(*(a for (a,v) in addrval)) == list(addrval)
         if atomic and not res:
             _log.warn('Writing failed. Trying to restore previous values')
             self.write_eeprom(*prev, wkey=wkey, check_read=check_read, atomic=False)
@@ -249,19 +359,27 @@ class Epson:
 
     # ('Ink Information', b'\x0f\x13\x03(BBB)*', 'inkCartridgeName inkColor inkRemainCounter')
 
-    def find_rkey(self, ikeys=range(0x0,0xffff)):
+    def find_rkey(self, ikeys=range(0x0,0xffff), batch=50):
         "Find and set the 2-bytes read key / model code (brute force)"
-        orig = self.spec.rkey
         pos = self.spec.mem_low
-        with self.ctrl_channel:
-            for c in ikeys:
-                _log.info('Trying model code %04X', c)
-                self.spec.rkey = c
-                if self.read_eeprom(pos)[0][1] is not None:
-                    _log.warn('Found model code: %04X', c)
-                    return c
-            else:
-                self.spec.rkey = orig
+        p, = _pack_addrs(_S_ADDR1 if self.spec.rlen == 1 else _S_ADDR2, (pos,))
+        CMD = ('|', 'A')
+        ikeys = iter(ikeys)
+        with self.ctrl_channel as ch:
+            # one ctrl call per batch of codes: pipelined on D4, a single GET on SNMP
+            while codes := tuple(itertools.islice(ikeys, batch)):
+                _log.info('Trying model codes %04X-%04X', codes[0], codes[-1])
+                resps = self.ctrl(*(self.encode(CMD, p, rkey=c) for c in codes))
+                if any(v is not None for (a, v) in
+                       self._decode_reads((pos,)*len(codes), resps)):
+                    # all probes read the same address, so a reply answering another
+                    # probe would go unnoticed: probe this batch again one at a time
+                    for c in codes:
+                        r = ch(self.encode(CMD, p, rkey=c))
+                        if self._decode_reads((pos,), (r,))[0][1] is not None:
+                            _log.warn('Found model code: %04X', c)
+                            self.spec.rkey = c
+                            return c
 
     def find_wkey(self, ikeys=(b'',), addr=None):
         "Try each key in ikeys iterable to write to addr"
@@ -298,7 +416,10 @@ class EpsonD4(Epson):
         # Or send '\x1b01@EJL ID\r\n' to data_channel / non-D4?
         r = self.ctrl(('di', b'\x01'))[0]
         assert isinstance(r, bytes) and r.isascii()
-        return re.match(r'^@EJL ID\s+((.|\s)+)', r.decode('ascii')).group(1)
+        s = r.decode('ascii')
+        if s.startswith('@EJL ID') and s[7:8].isspace() and (i := s[7:].lstrip()):
+            return i
+        return _EJLID_RE.match(s).group(1)
 
     @functools.cached_property
     def info(self) -> dict:
@@ -313,17 +434,34 @@ class EpsonD4(Epson):
 
 class EpsonSNMP(Epson):
 
+    batch_size = 50  # ctrl messages (OIDs) per GET request
+
     def _init_link(self):
         self.link.OID_EPSON = self.link.OID_ENTERPRISE + '.1248'
         self.link.OID_CTRL = self.link.OID_EPSON + '.1.2.2.44.1.1.2.1'
+        self._oid_prefix = self.link.OID_CTRL + '.'
         self.ctrl_channel = contextlib.nullcontext(self._ctrl_send)
 
+    def _ctrl_oid(self, m):
+        # message bytes are the OID suffix: *struct.unpack('B'*len(payload), payload)
+        return self._oid_prefix + '.'.join(map(str, m))
+
     def _ctrl_send(self, m):
-        # *struct.unpack('B'*len(payload), payload)
-        res = self.link.get('.'.join((self.link.OID_CTRL, *(str(b) for b in m))))
+        res = self.link.get(self._ctrl_oid(m))
         #
         return res[0][1].asOctets()
 
+    def _ictrl(self, *msg: bytes | tuple['cmd', 'payload']) -> typing.Iterator[bytes]:
+        msg = tuple(self._iencode(*msg))
+        for i in range(0, len(msg), self.batch_size):
+            chunk = msg[i:i+self.batch_size]
+            res = self.link.get_many(map(self._ctrl_oid, chunk)) if len(chunk) > 1 else None
+            if res and len(res) == len(chunk):
+                for (oid, val) in res:
+                    yield val.asOctets()
+            else: # one request per message
+                yield from map(self._ctrl_send, chunk)
+
     # @functools.cached_property
     @property
     def info(self) -> dict:
@@ -331,26 +469,33 @@ class EpsonSNMP(Epson):
 
 
 
+_S_BIN_OP = struct.Struct('<2xHH') # '||', length, rkey
+# literal '||' prefix lets `re` skip ahead with a fast substring search
+_BIN_OP_RE = re.compile(br'\|\|(?P<length>..)(?P<rkey>..)(?P<cmd>A\xbe\xa0|B\xbd!)', re.S)
+_PRINTABLE_RE = re.compile(b'[\x20-\x7E]{8,}')
+
 def search_bin(bstr=b'', yield_raw=True):
-    """Yields read/write operations found in bytes"""
-    pat = br'\|\|(?P<length>..)(?P<rkey>..)(?P<cmd>A\xbe\xa0|B\xbd!)'
-    for m in re.finditer(pat, bstr):
+    """Yields read/write operations found in bytes (or any buffer, like mmap)"""
+    for m in _BIN_OP_RE.finditer(bstr):
         try:
-            end = m.span()[1]
-            payload = bstr[end:end + struct.unpack('<H', m.group('length'))[0] - 5]
-            rkey = struct.unpack('<H', m.group('rkey'))[0]
-            if m.group('cmd')[0] == 0x41:
-                addr = struct.unpack('<H', payload[:2])[0]
+            start, end = m.span()
+            length, rkey = _S_BIN_OP.unpack_from(bstr, start)
+            payload = bstr[end:end + length - 5]
+            if bstr[end - 3] == 0x41:
+                addr, = _S_ADDR2.unpack_from(payload)
                 yield f'rkey:{rkey:04x} READ addr:{addr:04x}'
             else:
-                a,v = struct.unpack('<HB', payload[:3])
+                a,v = _S_WR2.unpack_from(payload)
                 yield f'rkey:{rkey:04x} WRITE addr:{a:04x} val:{v:02x} wkey:{payload[3:]}'
         except:
-            _log.exception()
+            _log.exception('Decoding %r failed', m.group())
             yield 'INVALID %r' % m.group()
     if yield_raw: # any 8-chars strings
-        for m in re.finditer(b'([\x20-\x7E]{8})', bstr):
-            yield m.group().decode('ascii')
+        # one match per printable run, cut in consecutive 8-chars pieces
+        for m in _PRINTABLE_RE.finditer(bstr):
+            r = m.group().decode('ascii')
+            for i in range(0, len(r) - 7, 8):
+                yield r[i:i+8]
 
 
 if __name__ == '__main__':
@@ -366,8 +511,12 @@ if __name__ == '__main__':
     args = c.parse_args()
 
     if args.search_file is not None:
-        for res in search_bin(args.search_file.read(),
-                              yield_raw=not args.search_file.name.endswith('.pcapng')):
+        import mmap
+        try:
+            buf = mmap.mmap(args.search_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError): # pipe, empty file
+            buf = args.search_file.read()
+        for res in search_bin(buf, yield_raw=not args.search_file.name.endswith('.pcapng')):
             print(res)
     else:
         c.print_help()
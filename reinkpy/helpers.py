@@ -20,13 +20,12 @@ TABLE = dict((*((i,' ') for i in (*range(0x00, 0x20), *range(0x7f, 0x100))),
 def hexdump(b, *, W=32, table=TABLE, prefix='\n'):
     if isinstance(b, str):
         b = bytes.fromhex(b)
-    def gen():
-        for i in range(0, len(b), W):
-            chunk = b[i:i+W]
-            h = ' '.join('%02X' % c for c in chunk)
-            a = charmap_decode(chunk, None, table)[0]
-            # yield ('%-{}s\n%-{}s'.format(3*W,3*W)) % (h, '  '.join(a))
-            yield ('%-{}s'.format(3*W)) % h
-            yield ('%-{}s'.format(3*W)) % '  '.join(a)
-            # yield '%-48s  |%-16s|' % (h, a)
-    return prefix + prefix.join(gen())
+    elif not isinstance(b, bytes): # any buffer, e.g. array.array from pyusb
+        b = bytes(b)
+    w = 3*W
+    lines = []
+    for i in range(0, len(b), W):
+        chunk = b[i:i+W]
+        lines.append(chunk.hex(' ').upper().ljust(w))
+        lines.append('  '.join(charmap_decode(chunk, None, table)[0]).ljust(w))
+    return prefix + prefix.join(lines)
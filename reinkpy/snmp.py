@@ -3,13 +3,19 @@ __all__ = (
     'SNMPLink',
 )
 
-from pysnmp.hlapi import *
-import contextlib, functools
+import contextlib, functools, threading, weakref
 import logging
 _log = logging.getLogger(__name__)
 del logging
 
 
+@functools.cache
+def _load_hlapi():
+    "Import pysnmp's (heavy) high-level API on first use"
+    import pysnmp.hlapi
+    return pysnmp.hlapi
+
+
 class SNMPLink:
 
     OID_PRINTER = '1.3.6.1.2.1.43'
@@ -22,33 +28,76 @@ class SNMPLink:
         assert version in ('1', '2c', '3')
         self.version = version
         self.user = user
+        # the loop, engine and transport are shared: one request at a time
+        self._lock = threading.Lock()
         # ObjectType(ObjectIdentity('SNMPv2-MIB', 'system'))# ('system', None)
         # self._engine.unregisterTransportDispatcher()
 
-    def _get_cmd(self, oid):
+    @functools.cached_property
+    def _engine(self):
+        return _load_hlapi().SnmpEngine()
+
+    @functools.cached_property
+    def _auth(self):
+        h = _load_hlapi()
         if self.version == '1':
-            auth = CommunityData(self.user, mpModel=0)
+            return h.CommunityData(self.user, mpModel=0)
         elif self.version == '2c':
-            auth = CommunityData(self.user, mpModel=1)
+            return h.CommunityData(self.user, mpModel=1)
         else:
-            auth = UsmUserData(self.user)
-        engine = SnmpEngine()
-        # TMPFIX: ensure running loop
+            return h.UsmUserData(self.user)
+
+    @functools.cached_property
+    def _transport(self):
+        return _load_hlapi().UdpTransportTarget((self.ip, self.port))
+
+    @functools.cached_property
+    def _loop(self):
         import asyncio
-        try: asyncio.get_running_loop()
-        except RuntimeError: asyncio.set_event_loop(asyncio.new_event_loop())
-        return getCmd(
-            engine,
-            auth,
-            UdpTransportTarget((self.ip, self.port)),
-            ContextData(),
-            ObjectType(ObjectIdentity(oid), None),
-            lookupMib=True
-        )
+        loop = asyncio.new_event_loop()
+        self._close_loop = weakref.finalize(self, loop.close) # unless closed before
+        return loop
+
+    def close(self):
+        "Close the event loop of the link (new ones are made if used again)"
+        with self._lock:
+            # the engine and transport are bound to the loop: drop them with it
+            for name in ('_engine', '_transport'):
+                self.__dict__.pop(name, None)
+            if self.__dict__.pop('_loop', None) is not None:
+                self._close_loop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_cmd(self, *oids):
+        h = _load_hlapi()
+        with self._lock:
+            # TMPFIX: ensure running loop
+            import asyncio
+            try: asyncio.get_running_loop()
+            except RuntimeError: asyncio.set_event_loop(self._loop)
+            return h.getCmd(
+                self._engine,
+                self._auth,
+                self._transport,
+                h.ContextData(),
+                *(h.ObjectType(h.ObjectIdentity(oid), None) for oid in oids),
+                lookupMib=True
+            )
 
     def get(self, oid):
         oid = getattr(self, f'OID_{oid}', oid)
-        eInd, eStat, eIdx, varBinds = self._get_cmd(oid) #_iget.send((oid, None))
+        return self._check(*self._get_cmd(oid)) #_iget.send((oid, None))
+
+    def get_many(self, oids):
+        "Get several OIDs with a single request"
+        return self._check(*self._get_cmd(*oids))
+
+    def _check(self, eInd, eStat, eIdx, varBinds):
         if eInd:
             _log.warn(eInd)
         elif eStat:
@@ -2,16 +2,18 @@ from . import Device, PREFACE
 
 import asciimatics as am, asciimatics.widgets as aw, asciimatics.scene, asciimatics.event
 #, screen, exceptions
-import asyncio, re, string, sys, logging, time
+import asyncio, collections, concurrent.futures, re, string, sys, logging, time
 _log = logging.getLogger('reinkpy.ui')
 
+_DO_RE = re.compile('do_', re.I)
+_WRITE_OP_RE = re.compile(r'reset|write', re.I)
+
+
+_EXEC = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='reinkpy')
 
 def run_sep(func, wait=False):
     "Run in separate thread"
-    from concurrent.futures import ThreadPoolExecutor
-    e = ThreadPoolExecutor()
-    f = e.submit(func)
-    e.shutdown(wait=wait)
+    f = _EXEC.submit(func)
     return f.result() if wait else f
 
 
@@ -93,7 +95,7 @@ class App:
         if self.model.value:
             self.ops.options = [
                 (getattr(self.driver, f).__doc__, f) for f in dir(self.driver)
-                if re.match('do_', f, re.I)] # do_(reset_All|(?!reset))
+                if _DO_RE.match(f)] # do_(reset_All|(?!reset))
             self.ops.disabled = False
         else:
             self.ops.options = [('(No operations available)', None)]
@@ -105,7 +107,7 @@ class App:
             def cb(sel):
                 if sel == 1: self.run_op(f)
             # TODO: better way to discriminate write operations
-            if re.search(r'reset|write', f.__doc__, re.I):
+            if _WRITE_OP_RE.search(f.__doc__):
                 self.ask(f"{f.__doc__}?", ["No", "Yes"], cb)
             else:
                 self.run_op(f)
@@ -151,6 +153,7 @@ class App:
                 break
             finally:
                 screen.close(leave)
+        _EXEC.shutdown(wait=True)
 
 
 def handle_input(event):
@@ -190,12 +193,22 @@ def scener(**nf):
 
 class LoggingWidget(aw.TextBox):
 
-    def __init__(self, name):
+    def __init__(self, name, maxlen=500):
         super().__init__(22, as_string=True, line_wrap=False, readonly=True, disabled=False)
+        self._buf = collections.deque(maxlen=maxlen) # last messages
+        self._dirty = False
         logging.getLogger(name).addHandler(logging.StreamHandler(self))
 
     def write(self, msg: str):
-        self.value = self.value + str(msg) + '\n'
+        self._buf.append(str(msg) + '\n')
+        self._dirty = True
+
+    def update(self, frame_no):
+        # set value once per redraw, not once per message
+        if self._dirty:
+            self._dirty = False
+            self.value = ''.join(self._buf)
+        super().update(frame_no)
 
     # TODO: modal dialog on level >= WARNING
     # def popup(self):
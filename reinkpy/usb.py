@@ -5,21 +5,56 @@ __all__ = (
 
 from .helpers import hexdump
 
-import functools
+import functools, importlib, os, time, weakref
 import logging
 _log = logging.getLogger(__name__)
+_DEBUG = logging.DEBUG
 del logging
 
+BACKENDS = ('libusb1', 'openusb', 'libusb0')
+# name of the last backend found, to try first and skip loading the others
+BACKEND_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                             'reinkpy', 'usb_backend')
+
+def _find_backend():
+    "(module, backend) from $REINKPY_USB_BACKEND, else the cached one, else the first found"
+    forced = os.environ.get('REINKPY_USB_BACKEND')
+    cached = None
+    if forced:
+        names = (forced,)
+    else:
+        try:
+            with open(BACKEND_CACHE) as f:
+                cached = f.read().strip()
+        except OSError:
+            pass
+        names = sorted(BACKENDS, key=lambda n: n != cached)
+    for name in names:
+        try:
+            m = importlib.import_module('usb.backend.' + name)
+        except ImportError as e:
+            _log.info(e)
+            continue
+        backend = m.get_backend()
+        if backend is not None:
+            if not forced and name != cached:
+                try:
+                    os.makedirs(os.path.dirname(BACKEND_CACHE), exist_ok=True)
+                    with open(BACKEND_CACHE, 'w') as f:
+                        f.write(name)
+                except OSError as e:
+                    _log.info(e)
+            return m, backend
+    return None, None
+
 AVAILABLE = False
+_BACKEND = None # passed to usb.core.find, so that pyusb does not probe its own order
 try:
     import usb
-    import usb.backend.libusb1, usb.backend.openusb, usb.backend.libusb0
-    for m in (usb.backend.libusb1, usb.backend.openusb, usb.backend.libusb0):
-        backend = m.get_backend()
-        if backend is not None:
-            _log.info('Using backend "%s"', m.__name__)
-            AVAILABLE = True
-            break
+    m, _BACKEND = _find_backend()
+    if _BACKEND is not None:
+        _log.info('Using backend "%s"', m.__name__)
+        AVAILABLE = True
 except ImportError as e:
     _log.warn(e)
 
@@ -28,6 +63,10 @@ DEVICE_FIELDS = ('idVendor', 'idProduct',
                  'iManufacturer', 'iProduct', 'iSerialNumber',
                  'manufacturer', 'product', 'serial_number')
 IFACE_FIELDS = ('bInterfaceNumber', 'bAlternateSetting')
+_KERNEL_DRIVER_SUPPORTED = None # False once the backend says not implemented
+ENUM_TTL = 2 # seconds to reuse an enumeration of the bus
+_ENUM_CACHE = {} # {(bClass, spec): (timestamp, [(dev, cfg, iface), ...])}
+_IO_POOL = weakref.WeakValueDictionary() # {(bus, address, iface, alt): UsbIO} in use
 
 
 class UsbIO:
@@ -38,26 +77,32 @@ class UsbIO:
 
     def write(self, data):
         # if len(data) > self.epOut.wMaxPacketSize: raise
-        _log.debug('Writing...:\n%r', hexdump(data))
+        if _log.isEnabledFor(_DEBUG):
+            _log.debug('Writing...:\n%r', hexdump(data))
         return self.epOut.write(data)
 
     def read(self, size=None):
         res = self.epIn.read(size or self.epIn.wMaxPacketSize)
-        _log.debug('Received %iB:\n%s', len(res), hexdump(res))
+        if _log.isEnabledFor(_DEBUG):
+            _log.debug('Received %iB:\n%s', len(res), hexdump(res))
         return res
 
     def __str__(self):
         return 'usb:{0.dev.bus}:{0.dev.address}:{0.ifc.bInterfaceNumber}:({0.epIn.bEndpointAddress},{0.epOut.bEndpointAddress})'.format(self)
 
     def __enter__(self):
+        global _KERNEL_DRIVER_SUPPORTED
         dev, i = self.dev, self.ifc.index
-        try:
-            if dev.is_kernel_driver_active(i):
-                dev.detach_kernel_driver(i)
-                # ? .claim_interface
-                self._detached_kernel_driver = i
-        except NotImplementedError:
-            _log.exception('Ignoring not implemented is_kernel_driver_active')
+        if _KERNEL_DRIVER_SUPPORTED is not False:
+            try:
+                if dev.is_kernel_driver_active(i):
+                    dev.detach_kernel_driver(i)
+                    # ? .claim_interface
+                    self._detached_kernel_driver = i
+                _KERNEL_DRIVER_SUPPORTED = True
+            except NotImplementedError:
+                _log.exception('Ignoring not implemented is_kernel_driver_active')
+                _KERNEL_DRIVER_SUPPORTED = False
         # _log.info('Setting configuration...')
         # try:
         #     dev.set_configuration(cfg)
@@ -80,7 +125,7 @@ class UsbIO:
             for (dev, cfg, ifc) in iter_interfaces():
                 eps = get_bulk_io(ifc)
                 if eps and ifc.bAlternateSetting == 0:
-                    yield cls(*eps, ifc, cfg, dev)
+                    yield cls._pooled(eps, ifc, cfg, dev)
 
     @classmethod
     def from_spec(cls, **spec):
@@ -97,48 +142,90 @@ class UsbIO:
         #     dev.set_configuration(cfg)
         # except usb.USBError as e:
         #     _log.warning('Failed to configure device: %s, %s', spec, e)
-        return cls(*eps, ifc, cfg, dev)
+        return cls._pooled(eps, ifc, cfg, dev)
+
+    @classmethod
+    def _pooled(cls, eps, ifc, cfg, dev):
+        "Instance for the interface, reused while still referenced (keeps its `info`)"
+        key = (dev.bus, dev.address, ifc.bInterfaceNumber, ifc.bAlternateSetting)
+        io = _IO_POOL.get(key)
+        # a replugged device may get the same address: only reuse the same enumerated device
+        if io is None or type(io) is not cls or io.dev is not dev:
+            io = _IO_POOL[key] = cls(*eps, ifc, cfg, dev)
+        return io
 
     @functools.cached_property
     def info(self):
-        return dict([(k, getattr(self.dev, k)) for k in DEVICE_FIELDS] +
+        strings = self._fetch_strings()
+        return dict([(k, strings[k] if k in strings else getattr(self.dev, k))
+                     for k in DEVICE_FIELDS] +
                     [(k, getattr(self.ifc, k)) for k in IFACE_FIELDS])
 
+    def _fetch_strings(self):
+        "Device string descriptors, read back to back (language id looked up once)"
+        dev = self.dev
+        return dict((k, usb.util.get_string(dev, i) if i else None) for (k, i) in (
+            ('manufacturer', dev.iManufacturer),
+            ('product', dev.iProduct),
+            ('serial_number', dev.iSerialNumber)))
+
 
 def iter_interfaces(bClass=BCLASS_PRINTER,  # match bDeviceClass or bInterfaceClass
                     **spec):
+    key = (bClass, frozenset(spec.items()))
+    now = time.monotonic()
+    hit = _ENUM_CACHE.get(key)
+    if hit is None or now - hit[0] > ENUM_TTL:
+        hit = _ENUM_CACHE[key] = (now, list(_iter_interfaces(bClass, **spec)))
+    return iter(hit[1])
+
+def _iter_interfaces(bClass, **spec):
     devspec = dict((k,v) for (k,v) in spec.items() if k in DEVICE_FIELDS and v is not None)
     ifacespec = dict((k,v) for (k,v) in spec.items() if k in IFACE_FIELDS and v is not None)
     _log.debug('Looking for interfaces matching:\n  device spec: %s \n  interface spec: %s',
                devspec, ifacespec)
-    m = is_bClass(bClass) if bClass is not None else None
-    for dev in usb.core.find(True, custom_match=m, **devspec):
-        _log.debug(dev._str())
-        for cfg in dev:
-            _log.debug(cfg._str())
-            for iface in usb.util.find_descriptor(cfg, True, **ifacespec):
-                _log.debug(iface._str())
-                if bClass is None or (
-                        dev.bDeviceClass == bClass or iface.bInterfaceClass == bClass):
-                    yield (dev, cfg, iface)
+    # class filtered on the cached descriptors first: only matching devices are walked
+    devs = [dev for dev in usb.core.find(True, backend=_BACKEND, **devspec)
+            if bClass is None or _has_class(dev, bClass)]
+    # descriptors are cached by libusb: the walk only does I/O to dump strings
+    for dev in devs:
+        yield from _walk_device(dev, bClass, ifacespec)
+
+def _has_class(dev, bClass):
+    "Whether dev or one of its interfaces is of class bClass (no I/O)"
+    return dev.bDeviceClass == bClass or any(
+        iface.bInterfaceClass == bClass for cfg in dev for iface in cfg)
+
+def _walk_device(dev, bClass, ifacespec):
+    "[(dev, cfg, iface)] of the matching interfaces of dev"
+    debug = _log.isEnabledFor(_DEBUG) # _str() fetches string descriptors
+    res = []
+    if debug: _log.debug('%s', dev._str())
+    for cfg in dev:
+        if debug: _log.debug('%s', cfg._str())
+        for iface in usb.util.find_descriptor(cfg, True, **ifacespec):
+            if debug: _log.debug('%s', iface._str())
+            if bClass is None or (
+                    dev.bDeviceClass == bClass or iface.bInterfaceClass == bClass):
+                res.append((dev, cfg, iface))
+    return res
 
 
 def get_bulk_io(iface):
-    i = usb.util.find_descriptor(iface, custom_match=lambda e: is_bulk(e) and is_in(e))
-    o = usb.util.find_descriptor(iface, custom_match=lambda e: is_bulk(e) and is_out(e))
+    "First (bulk in, bulk out) endpoints pair of iface, in one pass"
+    eps = [None, None, None]
+    for e in iface:
+        c = _classify(e)
+        if eps[c] is None:
+            eps[c] = e
+    i, o = eps[1], eps[2]
     return (i, o) if (i and o) else None
 
+def _classify(e):
+    "1 for a bulk in endpoint, 2 for bulk out, 0 otherwise"
+    # usb.util.ENDPOINT_TYPE_BULK, usb.util.ENDPOINT_IN
+    return 2 - (e.bEndpointAddress >> 7 & 1) if e.bmAttributes & 0x3 == 0x2 else 0
+
 is_bulk = lambda e: usb.util.endpoint_type(e.bmAttributes) == usb.util.ENDPOINT_TYPE_BULK
 is_in = lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_IN
 is_out = lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_OUT
-
-class is_bClass:
-    def __init__(self, bClass):
-        self.bClass = bClass
-    def __call__(self, device):
-        if device.bDeviceClass == self.bClass:
-            return True
-        for cfg in device: # if specified at interface
-            if usb.util.find_descriptor(cfg, bInterfaceClass=self.bClass):
-                return True
-        return False
@@ -8,42 +8,146 @@ import logging
 _log = logging.getLogger(__name__)
 
 try:
-    from zeroconf import Zeroconf, ServiceStateChange, IPVersion, ServiceBrowser
+    from zeroconf import Zeroconf, ServiceStateChange, IPVersion
+    from zeroconf.asyncio import AsyncZeroconf, AsyncServiceBrowser
 except ImportError as e:
     _log.warning(e)
     AVAILABLE = False
 else:
     AVAILABLE = True
 
-import collections, time
+import asyncio, collections, sys, threading, time
 
 
 class Browser:
 
+    resolve_ttl = 2 # seconds during which a resolved service is not queried again
+    max_resolves = 16 # concurrent service info queries
+    min_retry = 0.5 # seconds between two queries of a same service, even failed ones
+    max_addrs = 256 # per type, oldest dropped first
+    resolve_grace = 3 # seconds left to resolutions in progress when browsing ends
+
     def __init__(self, types=('_ipp._tcp.local.','_ipps._tcp.local.','_printer._tcp.local.')):
-        self.by_type = dict((k,{}) for k in types)
-        self.by_addr = collections.ChainMap(*self.by_type.values())
-        self.zc = Zeroconf() # ip_version=IPVersion.V4Only
-
-    def run(self, duration):
-        # starts a thread
-        with ServiceBrowser(self.zc, list(self.by_type.keys()), handlers=[self.on_change]):
-            _log.info('Looking for network devices (%s sec)...', duration)
-            time.sleep(duration)
+        self.by_type = dict((sys.intern(k), collections.OrderedDict()) for k in types)
+        self.by_addr = {} # all types together
+        self._pending = set()   # {(type, name)} being resolved
+        self._info_cache = {}   # {(type, name): (timestamp, info)}
+        self._last_resolve = {} # {(type, name): timestamp}
+        self.aiozc = None # opened by `run` or `async with Browser() as b:`
+
+    async def __aenter__(self):
+        self.aiozc = AsyncZeroconf() # ip_version=IPVersion.V4Only
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aiozc.async_close()
+        self.aiozc = None
+
+    def run(self, duration, stop_event=None):
+        "Browse for `duration` seconds, or until `stop_event` is set"
+        asyncio.run(self.arun(duration, stop_event))
+        return self
+
+    async def arun(self, duration, stop_event=None):
+        if self.aiozc is None:
+            async with self:
+                return await self.arun(duration, stop_event)
+        if stop_event is None:
+            stop_event = threading.Event()
+        self._loop = asyncio.get_running_loop()
+        self._sem = asyncio.Semaphore(self.max_resolves)
+        self._tasks = set()
+        browser = AsyncServiceBrowser(self.aiozc.zeroconf, list(self.by_type.keys()),
+                                      handlers=[self.on_change])
+        _log.info('Looking for network devices (%s sec)...', duration)
+        try:
+            await asyncio.to_thread(stop_event.wait, duration)
+        finally:
+            await browser.async_cancel()
+            if self._tasks: # services announced late in the window
+                await asyncio.wait(self._tasks, timeout=self.resolve_grace)
+            for t in self._tasks:
+                t.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        return self
+
+    def start(self, duration=None):
+        "Browse in the background (for at most `duration` seconds) until `stop`"
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run, args=(duration, self._stop_event),
+                                        name='reinkpy-zeroconf', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=0):
+        "Wait up to `timeout` seconds for browsing to end by itself, then stop it"
+        self._thread.join(timeout)
+        self._stop_event.set()
+        self._thread.join()
         return self
 
     def on_change(self, zeroconf: Zeroconf, service_type: str, name: str,
                   state_change: ServiceStateChange) -> None:
+        # called in the event loop: resolve in a task, not to hold up other changes
+        if service_type not in self.by_type:
+            return
         _log.info(f"Service {name} of type {service_type} changed: ${state_change.name}")
-        info = zeroconf.get_service_info(service_type, name)
+        t = self._loop.create_task(self._update(service_type, name, state_change))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+
+    async def _update(self, service_type, name, state_change):
+        key = (service_type, name)
+        if state_change is ServiceStateChange.Removed:
+            self._pending.discard(key)
+            self._last_resolve.pop(key, None)
+            info = self._info_cache.pop(key, (None, None))[1]
+        else:
+            info = await self._resolve(key)
+        if info is None:
+            return
         _log.debug(f"{info}")
         d = self.by_type[service_type]
         name = info.get_name()
         for a in info.parsed_scoped_addresses():
             if state_change in (ServiceStateChange.Added, ServiceStateChange.Updated):
-                d[a] = name
+                d[a] = self.by_addr[a] = name
+                d.move_to_end(a)
+                if len(d) > self.max_addrs:
+                    self._drop(d, next(iter(d)))
             elif state_change is ServiceStateChange.Removed:
-                d.pop(a, None)
+                self._drop(d, a)
+
+    def _drop(self, d, a):
+        d.pop(a, None)
+        # still there if advertised with another type
+        other = next((o[a] for o in self.by_type.values() if a in o), None)
+        if other is None:
+            self.by_addr.pop(a, None)
+        else:
+            self.by_addr[a] = other
+
+    async def _resolve(self, key):
+        "Query service info, unless already in progress or done recently"
+        now = time.monotonic()
+        ts = self._info_cache.get(key, (None,))[0]
+        if (key in self._pending or (ts is not None and now - ts < self.resolve_ttl)
+            or now - self._last_resolve.get(key, -self.min_retry) < self.min_retry):
+            return None
+        self._pending.add(key)
+        self._last_resolve[key] = now
+        info = None
+        try:
+            async with self._sem:
+                info = await self.aiozc.async_get_service_info(*key)
+        finally:
+            if key in self._pending:
+                self._pending.discard(key)
+                if info is not None:
+                    self._info_cache[key] = (now, info)
+            else: # removed meanwhile
+                info = None
+        return info
 
 
 def find(timeout=5):
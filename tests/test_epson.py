@@ -0,0 +1,135 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+import struct, unittest
+
+from reinkpy import d4, epson
+
+
+class FakePrinter:
+    "D4 peer answering TX commands and EEPROM reads/writes on the ctrl channel"
+
+    def __init__(self, drop=(), rkey=None, credit=None, coalesce=False):
+        self.eeprom = {a: a & 0xff for a in range(0x100)}
+        self.drop = set(drop)  # addresses whose first read reply is lost
+        self.rkey = rkey       # if set, reads with another key get no reply
+        self.credit = credit   # if set, total credit granted, none piggybacked
+        self.coalesce = coalesce # if set, a read returns all pending packets
+        self.out = []
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): pass
+
+    def read(self, size=None):
+        if self.coalesce:
+            b, self.out[:] = b''.join(self.out), ()
+            return b
+        return self.out.pop(0) if self.out else b''
+
+    def grant(self, n):
+        if self.credit is None:
+            return n
+        n = min(n, self.credit)
+        self.credit -= n
+        return n
+
+    def write(self, data):
+        data = bytes(data)
+        if data.startswith(b'\x00\x00\x00\x1b'): # exit packet mode
+            self.out.append(b'\x00\x00\x00\x08\x01\x00\xc5\x00')
+            return len(data)
+        psid, ssid, length, credit, control = struct.unpack_from('>BBHBB', data)
+        payload = data[6:length]
+        if (psid, ssid) == (0, 0):
+            r, credit = self.tx(payload), 1
+        else:
+            r, credit = self.ctrl(payload), int(self.credit is None)
+        if r is not None:
+            self.out.append(struct.pack('>BBHBB', psid, ssid, 6 + len(r), credit, 0) + r)
+        return len(data)
+
+    def tx(self, p):
+        code = p[0]
+        return {
+            0x00: lambda: b'\x80\x00\x20',
+            0x01: lambda: b'\x81\x00' + p[1:3] + struct.pack('>HHHH', 0x100, 0x100, 0, self.grant(1)),
+            0x02: lambda: b'\x82\x00' + p[1:3],
+            0x03: lambda: b'\x83\x00' + p[1:3],
+            0x04: lambda: b'\x84\x00' + p[1:3] + struct.pack('>H', self.grant(64)),
+            0x08: lambda: b'\x88\x00',
+            0x09: lambda: b'\x89\x00\x02' + p[1:],
+        }.get(code, lambda: b'\x7f\x00\x00\x87')()
+
+    def ctrl(self, m):
+        if m[:2] == b'||':
+            rkey, = struct.unpack_from('<H', m, 4)
+            if m[6:7] == b'A':
+                a, = struct.unpack_from('<H', m, 9)
+                if a in self.drop:
+                    self.drop.discard(a)
+                    return None
+                if self.rkey is not None and rkey != self.rkey:
+                    return None
+                return b'@BDC PS\r\nEE:%04X%02X;\x0c' % (a, self.eeprom[a])
+            if m[6:7] == b'B':
+                a, v = struct.unpack_from('<HB', m, 9)
+                self.eeprom[a] = v
+                return b'@BDC PS\r\n:OK;\x0c'
+        if m[:2] == b'di':
+            return b'@EJL ID\r\nMFG:EPSON;CMD:ESCPL2,BDC;MDL:R280 Series;CLS:PRINTER;'
+        return b'@BDC ' + m[:2] + b':NA;'
+
+
+def make_epson(**kw):
+    p = FakePrinter(**kw)
+    return p, epson.EpsonD4(d4.D4Link(p)).configure()
+
+
+class TestPipelinedCtrl(unittest.TestCase):
+
+    def test_read(self):
+        p, e = make_epson()
+        addrs = range(0x10, 0x30)
+        self.assertEqual(e.read_eeprom(*addrs), [(a, a) for a in addrs])
+
+    def test_dropped_reply(self):
+        p, e = make_epson(drop={0x13})
+        addrs = range(0x10, 0x30)
+        res = e.read_eeprom(*addrs)
+        self.assertEqual([a for (a, v) in res if v is None], [])
+        self.assertEqual(res, [(a, a) for a in addrs])
+
+    def test_coalesced_replies(self):
+        p, e = make_epson(coalesce=True)
+        addrs = range(0x10, 0x20)
+        self.assertEqual(e.read_eeprom(*addrs), [(a, a) for a in addrs])
+        self.assertEqual(e.link._received, b'')
+        with self.assertNoLogs('reinkpy', 'WARNING'):
+            self.assertEqual(e.ctrl(('st', b'\x01')), (b'@BDC st:NA;',))
+
+    def test_invalid_header(self):
+        p, e = make_epson()
+        with e.link, self.assertLogs('reinkpy.d4', 'WARNING'):
+            p.out.append(b'\x00' * 6) # length field 0, shorter than the header
+            self.assertEqual(e.ctrl(('st', b'\x01')), (b'@BDC st:NA;',))
+        self.assertEqual(e.link._received, b'')
+
+    def test_credit_runs_out(self):
+        p, e = make_epson(credit=10)
+        addrs = range(0x10, 0x30)
+        res = e.read_eeprom(*addrs)
+        n = sum(v is not None for (a, v) in res)
+        self.assertGreater(n, 0)
+        self.assertEqual(res, [(a, a if i < n else None) for (i, a) in enumerate(addrs)])
+
+    def test_write_list_pairs(self):
+        p, e = make_epson()
+        self.assertTrue(e.write_eeprom([0x20, 0x99], [0x21, 0x98], wkey=b'\0' * 8))
+        self.assertEqual((p.eeprom[0x20], p.eeprom[0x21]), (0x99, 0x98))
+
+    def test_find_rkey(self):
+        p, e = make_epson(rkey=0x1234)
+        self.assertEqual(e.find_rkey(range(0x1200, 0x1300)), 0x1234)
+        self.assertEqual(e.spec.rkey, 0x1234)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+import array, unittest
+
+from reinkpy.helpers import hexdump
+
+
+class TestHexdump(unittest.TestCase):
+
+    def test_format(self):
+        self.assertEqual(hexdump(b'\x1bAB\r\x00 ~\x7f', W=4),
+                         '\n1B 41 42 0D \nÊ  A  B  Ř  \n00 20 7E 7F \n°     ~  ¬  ')
+
+    def test_buffers(self):
+        b = bytes(range(256)) + b'\x1b@EJL\r\n'
+        for x in (bytearray(b), memoryview(b), array.array('B', b), b.hex()):
+            self.assertEqual(hexdump(x), hexdump(b), type(x))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,13 +2,19 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 import sys
 
+_TABLES = {1: bytes((i + 1) & 0xff for i in range(256))}
+
 def caesar(b, shift=1):
-    return bytes(c + shift for c in b)
+    t = _TABLES.get(shift)
+    if t is None:
+        t = _TABLES[shift] = bytes((i + shift) & 0xff for i in range(256))
+    return b.translate(t)
 
-def line_to_key(line):
-    line = line[:-1]
-    return caesar(f'{line[0].upper()}{line[1:8].lower():.<7}'.encode('ascii')).decode('ascii') if line else ''
+def line_to_key(line: bytes) -> bytes:
+    line = line.rstrip(b'\r\n') # CRLF too, as text-mode stdin did
+    return caesar(line[:1].upper() + line[1:8].lower().ljust(7, b'.')) if line else b''
 
 if __name__ == '__main__':
-    for line in sys.stdin:
-        sys.stdout.write(line_to_key(line)+'\n')
+    # a block of lines at a time, written back with a single call
+    for lines in iter(lambda: sys.stdin.buffer.readlines(1 << 16), []):
+        sys.stdout.buffer.write(b''.join([line_to_key(line)+b'\n' for line in lines]))